@@ -1,7 +1,42 @@
 # google_ads.py
+import threading
+
+import numpy as np
+from cachetools import TTLCache, cached
 from google.ads.googleads.client import GoogleAdsClient
 
 
+# Shared client/service, created once per process so gRPC channels stay warm
+_CLIENT = None
+_SERVICE = None
+_CLIENT_LOCK = threading.Lock()
+
+# Keyword idea metrics only refresh daily; keep results for an hour per seed set
+_KEYWORD_CACHE = TTLCache(maxsize=512, ttl=3600)
+_KEYWORD_CACHE_LOCK = threading.Lock()
+
+
+def init_client(config: dict):
+    """Build the shared client from an already-parsed google_ads.yaml dict."""
+    global _CLIENT, _SERVICE
+    with _CLIENT_LOCK:
+        client = GoogleAdsClient.load_from_dict(config)
+        _SERVICE = client.get_service("KeywordPlanIdeaService")
+        _CLIENT = client
+
+
+def _get_client():
+    global _CLIENT, _SERVICE
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                # fallback when init_client() was not called or failed
+                client = GoogleAdsClient.load_from_storage("google_ads.yaml")
+                _SERVICE = client.get_service("KeywordPlanIdeaService")
+                _CLIENT = client
+    return _CLIENT, _SERVICE
+
+
 def get_keywords_from_google(customer_id: str,
                              seed_keywords=None,
                              page_url=None,
@@ -9,20 +44,31 @@ def get_keywords_from_google(customer_id: str,
                              language_id="1000"):
     """
     Calls KeywordPlanIdeaService to generate keyword ideas.
-    Returns a list of dicts with keys:
-      - keyword
-      - search_volume
-      - competition
-      - match_types
-      - cpc_range
+    Returns a dict of parallel numpy arrays (one row per keyword idea):
+      - keyword (object)
+      - search_volume (int64, 0 when unknown)
+      - competition (object, enum name or None)
+      - top_of_page_bid_low / top_of_page_bid_high (float64 currency units, NaN when unknown)
+    Results are cached per (customer, seeds, url, locations, language); callers get copies.
     """
+    columns = _fetch_keyword_ideas(
+        customer_id,
+        tuple(sorted(seed_keywords or ())),
+        page_url,
+        tuple(location_ids or ()),
+        language_id,
+    )
+    return {name: values.copy() for name, values in columns.items()}
 
-    client = GoogleAdsClient.load_from_storage("google_ads.yaml")
-    service = client.get_service("KeywordPlanIdeaService")
+
+@cached(cache=_KEYWORD_CACHE, lock=_KEYWORD_CACHE_LOCK)
+def _fetch_keyword_ideas(customer_id, seed_keywords, page_url, location_ids, language_id):
+    client, service = _get_client()
 
     request = client.get_type("GenerateKeywordIdeasRequest")
     request.customer_id = customer_id
     request.language = f"languageConstants/{language_id}"
+    request.keyword_plan_network = client.enums.KeywordPlanNetworkEnum.GOOGLE_SEARCH
 
     if location_ids:
         request.geo_target_constants.extend([f"geoTargetConstants/{loc}" for loc in location_ids])
@@ -35,25 +81,20 @@ def get_keywords_from_google(customer_id: str,
 
     response = service.generate_keyword_ideas(request=request)
 
-    keywords = []
+    texts, vols, comps, lows, highs = [], [], [], [], []
     for idea in response:
         metrics = idea.keyword_idea_metrics
-        # safe extraction of bids (micros -> currency)
-        low_bid = (metrics.low_top_of_page_bid_micros / 1e6) if getattr(metrics, "low_top_of_page_bid_micros", None) else None
-        high_bid = (metrics.high_top_of_page_bid_micros / 1e6) if getattr(metrics, "high_top_of_page_bid_micros", None) else None
-
-        cpc_range = None
-        if low_bid and high_bid:
-            cpc_range = f"${low_bid:.2f} - ${high_bid:.2f}"
-
-        keywords.append({
-            "keyword": idea.text,
-            "search_volume": int(metrics.avg_monthly_searches) if getattr(metrics, "avg_monthly_searches", None) is not None else None,
-            "competition": metrics.competition.name if getattr(metrics, "competition", None) else None,
-            "match_types": ["Exact", "Phrase"],   # default placeholder
-            "cpc_range": cpc_range,
-            "top_of_page_bid_low": low_bid,
-            "top_of_page_bid_high": high_bid,
-        })
-
-    return keywords
+        texts.append(idea.text)
+        vols.append(metrics.avg_monthly_searches or 0)
+        comps.append(metrics.competition.name if metrics.competition else None)
+        lows.append(metrics.low_top_of_page_bid_micros or np.nan)
+        highs.append(metrics.high_top_of_page_bid_micros or np.nan)
+
+    # micros -> currency
+    return {
+        "keyword": np.array(texts, dtype=object),
+        "search_volume": np.array(vols, dtype=np.int64),
+        "competition": np.array(comps, dtype=object),
+        "top_of_page_bid_low": np.array(lows, dtype=np.float64) / 1e6,
+        "top_of_page_bid_high": np.array(highs, dtype=np.float64) / 1e6,
+    }
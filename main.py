@@ -1,13 +1,25 @@
 # main.py
+import asyncio
+import hashlib
 import json
+import logging
+import math
 import re
+import sqlite3
+import threading
+import time
+import numpy as np
+import orjson
 import yaml
-from typing import List, Dict, Any
+from collections import OrderedDict
+from contextlib import closing
+from typing import List, Dict, Any, Optional, FrozenSet, Tuple
 
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 import google.generativeai as genai
 
-from google_ads import get_keywords_from_google
+from google_ads import get_keywords_from_google, init_client
 from schemas import (
     SEMInputs,
     SEMOutput,
@@ -19,9 +31,12 @@ from schemas import (
 from fastapi.middleware.cors import CORSMiddleware
 
 
+logger = logging.getLogger(__name__)
+
+
 # FastAPI setup
 
-app = FastAPI(title="SEM Planning Tool")
+app = FastAPI(title="SEM Planning Tool", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -34,8 +49,19 @@ app.add_middleware(
 
 # Load Google Ads + Gemini API config
 
+# C-backed loader when libyaml is available
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 with open("google_ads.yaml", "r") as f:
-    config = yaml.safe_load(f)
+    config = yaml.load(f, Loader=_YAML_LOADER)
+
+# Share the parsed config with the Google Ads client instead of re-reading the file.
+# A bad Ads config must not stop the API: requests then retry via load_from_storage
+# and report the error as a 500, like before.
+try:
+    init_client(config)
+except Exception:
+    logger.exception("Google Ads client init failed; falling back to per-request loading")
 
 # Configure Gemini
 if "google_llm_api_key" in config and config["google_llm_api_key"]:
@@ -48,46 +74,203 @@ else:
 
 # Utility functions
 
+_SCHEME_RE = re.compile(r"https?://")
+_WWW = "www."
+_JSON_DECODER = json.JSONDecoder()
+
+
 def clean_domain(url: str) -> str:
     if not url:
         return ""
-    u = re.sub(r"https?://", "", url)
-    u = u.replace("www.", "")
-    return u.split(".")[0].lower()
+    u = _SCHEME_RE.sub("", url)
+    u = u.replace(_WWW, "")
+    return u.partition(".")[0].lower()
+
+
+def compile_terms(terms: List[str]) -> Optional["re.Pattern[str]"]:
+    """Single alternation regex matching any of terms as a substring (None if no terms)."""
+    if not terms:
+        return None
+    return re.compile("|".join(re.escape(t) for t in terms))
+
+
+# Gemini theme name -> PMax bucket, checked in priority order (substring match)
+_THEME_BUCKETS = [
+    ("product", ["product", "protein", "whey", "vegan", "organic"]),
+    ("usecase", ["use", "recovery", "weight"]),
+    ("demographic", ["city", "india", "delhi", "mumbai", "location"]),
+    ("seasonal", ["season", "summer", "winter", "holiday", "fest", "diwali", "xmas"]),
+]
+_THEME_BUCKET_PATTERNS = [(bucket, compile_terms(words)) for bucket, words in _THEME_BUCKETS]
+
+
+def uniq(seq) -> list:
+    """Order-preserving de-duplication."""
+    return list(dict.fromkeys(seq))
+
+
+def nan_to_none(values: np.ndarray) -> List[Optional[float]]:
+    return [None if math.isnan(v) else v for v in values.tolist()]
+
+
+def format_cpc_range(low: Optional[float], high: Optional[float]) -> Optional[str]:
+    if not (low and high):
+        return None
+    return f"${low:.2f} - ${high:.2f}"
 
 
 def parse_llm_json(text: str) -> Dict[str, Any]:
-    """Try to extract JSON out of LLM text safely."""
+    """Extract the first JSON object out of LLM text (code fences / prose around it are skipped)."""
     if not text:
         return {}
-    text = text.strip()
+    start = text.find("{")
+    if start == -1:
+        return {}
+    try:
+        parsed, _ = _JSON_DECODER.raw_decode(text, start)
+    except ValueError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+class ThemeCache:
+    """
+    Caches bucketed Gemini theme keywords by normalised keyword set.
+    An in-process LRU sits in front of a SQLite table (exact match on a digest of the
+    set), so entries survive restarts and are shared between uvicorn workers. Rows
+    expire after ttl seconds and the table is pruned to max_rows.
+    Large sets (>= near_match_min keywords, i.e. Gemini run on the Ads keyword list)
+    also hit an in-process entry whose Jaccard similarity is >= threshold; below that
+    size a 0.92 threshold can only match the exact set, so the scan is skipped.
+    """
+
+    def __init__(self, path: str = "theme_cache.sqlite3", maxsize: int = 256, max_rows: int = 2048,
+                 ttl: float = 7 * 24 * 3600, threshold: float = 0.92, near_match_min: int = 13):
+        self.path = path
+        self.maxsize = maxsize
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.threshold = threshold
+        self.near_match_min = near_match_min
+        # digest -> (keyword set, buckets, created_at)
+        self._entries: "OrderedDict[str, Tuple[FrozenSet[str], Dict[str, List[str]], float]]" = OrderedDict()
+        self._lock = threading.Lock()  # get/put run in worker threads
+        self._table_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # the file/table is only created on first use, never at import
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._table_ready:
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS theme_buckets "
+                    "(key TEXT PRIMARY KEY, buckets TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+            self._table_ready = True
+        return conn
+
+    @staticmethod
+    def _key(keywords: List[str]) -> Tuple[FrozenSet[str], str]:
+        kwset = frozenset(k.strip().lower() for k in keywords if k)
+        return kwset, hashlib.sha256(orjson.dumps(sorted(kwset))).hexdigest()
+
+    def _remember(self, digest: str, kwset: FrozenSet[str], buckets: Dict[str, List[str]], created_at: float) -> None:
+        with self._lock:
+            self._entries[digest] = (kwset, buckets, created_at)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _lookup_memory(self, digest: str, kwset: FrozenSet[str], now: float) -> Optional[Dict[str, List[str]]]:
+        with self._lock:
+            for stale in [d for d, (_, _, created_at) in self._entries.items() if now - created_at >= self.ttl]:
+                del self._entries[stale]
+
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return self._entries[digest][1]
+
+            if len(kwset) < self.near_match_min:
+                return None
+            best_digest, best_sim = None, 0.0
+            for d, (stored, _, _) in self._entries.items():
+                sim = len(kwset & stored) / len(kwset | stored)
+                if sim > best_sim:
+                    best_digest, best_sim = d, sim
+            if best_digest is not None and best_sim >= self.threshold:
+                self._entries.move_to_end(best_digest)
+                return self._entries[best_digest][1]
+        return None
+
+    def get(self, keywords: List[str]) -> Optional[Dict[str, List[str]]]:
+        kwset, digest = self._key(keywords)
+        now = time.time()
+        buckets = self._lookup_memory(digest, kwset, now)
+        if buckets is not None:
+            return buckets
+
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT buckets, created_at FROM theme_buckets WHERE key = ? AND created_at > ?",
+                (digest, now - self.ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        buckets = orjson.loads(row[0])
+        self._remember(digest, kwset, buckets, row[1])
+        return buckets
+
+    def put(self, keywords: List[str], buckets: Dict[str, List[str]]) -> None:
+        kwset, digest = self._key(keywords)
+        now = time.time()
+        self._remember(digest, kwset, buckets, now)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO theme_buckets (key, buckets, created_at) VALUES (?, ?, ?)",
+                (digest, orjson.dumps(buckets).decode(), now),
+            )
+            conn.execute("DELETE FROM theme_buckets WHERE created_at <= ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM theme_buckets WHERE key NOT IN "
+                "(SELECT key FROM theme_buckets ORDER BY created_at DESC LIMIT ?)",
+                (self.max_rows,),
+            )
+
+
+# Only used (and its SQLite file only created) when Gemini is configured
+theme_cache = ThemeCache() if model else None
+
+
+def cache_get(keywords: List[str]) -> Optional[Dict[str, List[str]]]:
+    """Theme cache lookup that fails open: cache errors are logged and treated as a miss."""
+    try:
+        return theme_cache.get(keywords) if theme_cache else None
+    except Exception:
+        logger.warning("Theme cache lookup failed; calling Gemini", exc_info=True)
+        return None
+
+
+def cache_put(keywords: List[str], buckets: Dict[str, List[str]]) -> None:
+    """Theme cache write that fails open: cache errors are logged and ignored."""
     try:
-        return json.loads(text)
+        if theme_cache:
+            theme_cache.put(keywords, buckets)
     except Exception:
-        start = text.find("{")
-        end = text.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            try:
-                return json.loads(text[start:end+1])
-            except Exception:
-                pass
-    return {}
+        logger.warning("Theme cache write failed", exc_info=True)
 
 
-def generate_pmax_themes_llm(keywords: List[str], locations: List[str]) -> Dict[str, PMaxTheme]:
+async def request_pmax_themes_llm(keywords: List[str]) -> Dict[str, Any]:
     """
     Call Gemini to group keywords into PMax campaign themes.
-    Returns dict with product, usecase, demographic, seasonal themes.
+    Returns keyword lists per bucket (see bucket_llm_themes), or {} when Gemini is
+    unavailable, fails, or replies with nothing usable.
     """
-    fallback = {
-        "product": PMaxTheme(keywords=keywords, total_volume=0),
-        "usecase": PMaxTheme(keywords=[kw for kw in keywords if len(kw.split()) >= 3], total_volume=0),
-        "demographic": PMaxTheme(keywords=locations, total_volume=0),
-        "seasonal": PMaxTheme(keywords=[f"{loc} seasonal trends" for loc in locations], total_volume=0),
-    }
-
     if not model:
-        return fallback
+        return {}
+
+    buckets = await asyncio.to_thread(cache_get, keywords)
+    if buckets is not None:
+        return buckets
 
     prompt = f"""
 You are a Google Ads strategist. Group the following keywords into up to 6 Performance Max campaign themes.
@@ -107,52 +290,79 @@ Produce JSON ONLY in this format:
 }}
 
 Keywords:
-{json.dumps(keywords)}
+{orjson.dumps(keywords).decode()}
 
 Also include seasonal groups if any, and list location-based themes if relevant.
 """
 
     try:
-        resp = model.generate_content(prompt)
+        resp = await model.generate_content_async(prompt)
         resp_text = resp.text if hasattr(resp, "text") else str(resp)
     except Exception:
-        return fallback
-
-    parsed = parse_llm_json(resp_text)
-    themes_list = parsed.get("themes") or []
-
-    product_keywords, usecase_long, demographic_keywords, seasonal_keywords = [], [], [], []
-
-    if isinstance(themes_list, list):
-        for t in themes_list:
-            name = t.get("name", "").lower() if isinstance(t, dict) else ""
-            kws = t.get("keywords", []) if isinstance(t, dict) else []
-            if not isinstance(kws, list):
-                kws = []
-            if any(w in name for w in ["product", "protein", "whey", "vegan", "organic"]):
-                product_keywords.extend(kws)
-            elif any(w in name for w in ["use", "recovery", "weight"]):
-                usecase_long.extend(kws)
-            elif any(w in name for w in ["city", "india", "delhi", "mumbai", "location"]):
-                demographic_keywords.extend(kws)
-            elif any(w in name for w in ["season", "summer", "winter", "holiday", "fest", "diwali", "xmas"]):
-                seasonal_keywords.extend(kws)
-            else:
-                product_keywords.extend(kws)
-
-    def uniq(seq):
-        seen, out = set(), []
-        for x in seq:
-            if x not in seen:
-                seen.add(x)
-                out.append(x)
-        return out
+        return {}
+
+    # only well-formed, normalised replies are cached
+    buckets = bucket_llm_themes(parse_llm_json(resp_text))
+    if buckets:
+        await asyncio.to_thread(cache_put, keywords, buckets)
+    return buckets
+
+
+def bucket_llm_themes(parsed: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    Normalise a Gemini reply into de-duplicated keyword lists per PMax bucket
+    (product, usecase, demographic, seasonal). Returns {} if it has no usable themes.
+    """
+    themes_list = parsed.get("themes")
+    if not isinstance(themes_list, list):
+        return {}
+
+    buckets: Dict[str, List[str]] = {bucket: [] for bucket, _ in _THEME_BUCKETS}
+
+    for t in themes_list:
+        if not isinstance(t, dict):
+            continue
+        name = t.get("name")
+        name = name.lower() if isinstance(name, str) else ""
+        kws = t.get("keywords")
+        if not isinstance(kws, list):
+            kws = []
+        # pydantic v2 does not coerce numbers to str; drop anything else (dicts, lists, None)
+        kws = [str(k) for k in kws if isinstance(k, (str, int, float))]
+        bucket = next((b for b, pat in _THEME_BUCKET_PATTERNS if pat.search(name)), "product")
+        buckets[bucket].extend(kws)
+
+    if not any(buckets.values()):
+        return {}
+    return {bucket: uniq(kws) for bucket, kws in buckets.items()}
+
+
+def build_pmax_themes(buckets: Dict[str, List[str]], keywords: List[str], keywords_lower: List[str],
+                      locations: List[str]) -> Dict[str, PMaxTheme]:
+    """
+    Build PMax themes from bucketed Gemini keywords (see bucket_llm_themes).
+    keywords are the Google Ads keyword texts (keywords_lower: same, already lowercased):
+    LLM keywords are restricted to them (a bucket with no overlap keeps its LLM keywords),
+    and they back the fallback when Gemini returned nothing.
+    """
+    if not buckets:
+        return {
+            "product": PMaxTheme(keywords=keywords, total_volume=0),
+            "usecase": PMaxTheme(keywords=[kw for kw in keywords if len(kw.split()) >= 3], total_volume=0),
+            "demographic": PMaxTheme(keywords=locations, total_volume=0),
+            "seasonal": PMaxTheme(keywords=[f"{loc} seasonal trends" for loc in locations], total_volume=0),
+        }
+
+    ads_keywords = set(keywords_lower)
+
+    def restrict(kws: List[str]) -> List[str]:
+        return [k for k in kws if k.lower() in ads_keywords] or kws
 
     return {
-        "product": PMaxTheme(keywords=uniq(product_keywords) or uniq(keywords), total_volume=0),
-        "usecase": PMaxTheme(keywords=uniq(usecase_long), total_volume=0),
-        "demographic": PMaxTheme(keywords=uniq(demographic_keywords) or locations, total_volume=0),
-        "seasonal": PMaxTheme(keywords=uniq(seasonal_keywords), total_volume=0),
+        "product": PMaxTheme(keywords=restrict(buckets["product"]) or uniq(keywords), total_volume=0),
+        "usecase": PMaxTheme(keywords=restrict(buckets["usecase"]), total_volume=0),
+        "demographic": PMaxTheme(keywords=restrict(buckets["demographic"]) or locations, total_volume=0),
+        "seasonal": PMaxTheme(keywords=restrict(buckets["seasonal"]), total_volume=0),
     }
 
 
@@ -160,52 +370,100 @@ Also include seasonal groups if any, and list location-based themes if relevant.
 # Main endpoint
 
 @app.post("/generate_sem_plan/", response_model=SEMOutput)
-def generate_sem_plan(inputs: SEMInputs):
+async def generate_sem_plan(inputs: SEMInputs):
     """
     Generate SEM plan using Google Ads keyword ideas + Gemini clustering.
     """
 
-    # 1) Fetch keywords from Google Ads
+    # Tokenize target locations once; reused for classification and output
+    locations_list = [l.strip() for l in inputs.target_locations.split(",")] if inputs.target_locations else []
+    locations_lower = [l.lower() for l in locations_list]
+
+    # 1) Fetch keywords from Google Ads (blocking gRPC client -> worker thread)
+    #    while Gemini clusters the seed themes concurrently
+    ads_task = asyncio.create_task(asyncio.to_thread(
+        get_keywords_from_google,
+        customer_id=config.get("google_ads_customer_id", ""),
+        seed_keywords=inputs.themes,
+        page_url=inputs.brand_website or inputs.competitor_website,  # ✅ use competitor if brand missing
+        location_ids=None,
+        language_id="1000",
+    ))
+    gemini_task = (
+        asyncio.create_task(request_pmax_themes_llm(inputs.themes))
+        if model and inputs.themes else None
+    )
+    try:
+        return await _build_sem_plan(inputs, ads_task, gemini_task, locations_list, locations_lower)
+    finally:
+        # no-op when already awaited; stops a dangling Gemini call if the plan failed
+        if gemini_task is not None:
+            gemini_task.cancel()
+
+
+async def _build_sem_plan(inputs: SEMInputs, ads_task, gemini_task, locations_list: List[str], locations_lower: List[str]) -> SEMOutput:
+    """Rest of the pipeline once the Ads (and optional Gemini) tasks are in flight."""
     try:
-        keywords_data = get_keywords_from_google(
-            customer_id=config.get("google_ads_customer_id", ""),
-            seed_keywords=inputs.themes,
-            page_url=inputs.brand_website or inputs.competitor_website,  # ✅ use competitor if brand missing
-            location_ids=None,
-            language_id="1000",
-        )
+        keywords_data = await ads_task
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching keywords: {e}")
 
-    # 2) Filter keywords (volume >= 500)
-    keywords_data = [
-        kw for kw in keywords_data if kw.get("search_volume") and kw["search_volume"] >= 500
-    ]
+    # 2) Filter keywords (volume >= 500) on the columnar Ads response
+    vols = keywords_data["search_volume"]
+    lows = keywords_data["top_of_page_bid_low"]
+    highs = keywords_data["top_of_page_bid_high"]
 
-    # Convert into KeywordFull objects
-    keyword_objects: List[KeywordFull] = [
-        KeywordFull(
-            keyword=kw.get("keyword"),
-            search_volume=kw.get("search_volume"),
-            competition=kw.get("competition"),
-            cpc_range=kw.get("cpc_range"),
-        )
-        for kw in keywords_data
-    ]
+    mask = vols >= 500
+    vols = vols[mask]
+    lows = lows[mask]
+    highs = highs[mask]
+    mids = (lows + highs) * 0.5
+    has_cpc = ~np.isnan(mids)
 
-    total_keywords = len(keyword_objects)
-    total_volume = sum((k.search_volume or 0) for k in keyword_objects)
+    total_keywords = int(mask.sum())
+    total_volume = int(vols.sum())
 
     # Average CPC
-    cpc_midpoints = []
-    for k in keyword_objects:
-        if k.cpc_range:
-            try:
-                low, high = [float(p.strip().replace("$", "")) for p in k.cpc_range.split("-")]
-                cpc_midpoints.append((low + high) / 2.0)
-            except Exception:
-                pass
-    avg_cpc = round(sum(cpc_midpoints) / max(1, len(cpc_midpoints)), 2) if cpc_midpoints else 0.0
+    avg_cpc = round(float(mids[has_cpc].mean()), 2) if has_cpc.any() else 0.0
+
+    # Shopping CPC target (ROI-driven)
+    conversion_rate = 0.02
+    total_budget = inputs.budget_allocations.cap + inputs.budget_allocations.bud + inputs.budget_allocations.pmax
+    target_cpc = round((total_budget * conversion_rate) / max(1, total_volume), 2) if total_volume > 0 else 0.0
+    suggested = np.where(has_cpc, np.minimum(mids, target_cpc).round(2), target_cpc)
+
+    # Single pass: KeywordFull + ShoppingCPCSuggestion per kept keyword
+    # (model_construct skips validation, values come straight from Google Ads)
+    texts = keywords_data["keyword"][mask].tolist()
+    texts_lower = [(t or "").lower() for t in texts]
+    keyword_objects: List[KeywordFull] = []
+    shopping_cpc: List[ShoppingCPCSuggestion] = []
+    for text, vol, comp, low, high, cpc in zip(
+        texts,
+        vols.tolist(),
+        keywords_data["competition"][mask].tolist(),
+        nan_to_none(lows),
+        nan_to_none(highs),
+        suggested.tolist(),
+    ):
+        keyword_objects.append(
+            KeywordFull.model_construct(
+                keyword=text,
+                search_volume=vol,
+                competition=comp,
+                low=low,
+                high=high,
+                cpc_range=format_cpc_range(low, high),
+            )
+        )
+        shopping_cpc.append(
+            ShoppingCPCSuggestion.model_construct(
+                keyword=text,
+                search_volume=vol,
+                competition=comp,
+                suggested_cpc=cpc,
+            )
+        )
 
    
     # Build search ad groups with match type rules
@@ -232,52 +490,32 @@ def generate_sem_plan(inputs: SEMInputs):
         "Location-based Queries": [],
     }
 
-    for kw in keyword_objects:
-        text = (kw.keyword or "").lower()
-        if brand_key and brand_key in text:
-            search_groups["Brand & Product Terms"].append(kw)
-        elif competitor_key and competitor_key in text:
-            search_groups["Competitor Terms"].append(kw)
-        elif inputs.target_locations and any(
-            loc.strip().lower() in text for loc in inputs.target_locations.split(",")
-        ):
-            search_groups["Location-based Queries"].append(kw)
-        elif len(text.split()) >= 3:
-            search_groups["Informational Queries"].append(kw)
-        else:
-            search_groups["Category Terms"].append(kw)
+    # (group, pattern) in priority order; first match wins
+    classifiers = [
+        (group, pat)
+        for group, pat in (
+            ("Brand & Product Terms", compile_terms([brand_key] if brand_key else [])),
+            ("Competitor Terms", compile_terms([competitor_key] if competitor_key else [])),
+            ("Location-based Queries", compile_terms(locations_lower)),
+        )
+        if pat is not None
+    ]
 
-   
-    # PMax themes with Gemini (fallback if not available)
+    for kw, text in zip(keyword_objects, texts_lower):
+        group = next((g for g, pat in classifiers if pat.search(text)), None)
+        if group is None:
+            group = "Informational Queries" if text.count(" ") >= 2 else "Category Terms"
+        search_groups[group].append(kw)
 
-    locations_list = [l.strip() for l in inputs.target_locations.split(",")] if inputs.target_locations else []
-    pmax_map = generate_pmax_themes_llm([k.keyword for k in keyword_objects], locations_list)
-
-    
-    # Shopping CPC suggestions (ROI-driven)
    
-    shopping_cpc: List[ShoppingCPCSuggestion] = []
-    conversion_rate = 0.02
-    total_budget = inputs.budget_allocations.cap + inputs.budget_allocations.bud + inputs.budget_allocations.pmax
-    target_cpc = round((total_budget * conversion_rate) / max(1, total_volume), 2) if total_volume > 0 else 0.0
-
-    for kw in keyword_objects:
-        suggested = target_cpc
-        if kw.cpc_range:
-            try:
-                low, high = [float(p.strip().replace("$", "")) for p in kw.cpc_range.split("-")]
-                midpoint = (low + high) / 2.0
-                suggested = round(min(midpoint, target_cpc), 2)
-            except Exception:
-                pass
-        shopping_cpc.append(
-            ShoppingCPCSuggestion(
-                keyword=kw.keyword,
-                search_volume=kw.search_volume,
-                competition=kw.competition,
-                suggested_cpc=suggested,
-            )
-        )
+    # PMax themes with Gemini (fallback to Ads keywords if not available);
+    # without seed themes Gemini clusters the Ads keywords instead
+
+    if gemini_task is not None:
+        buckets = await gemini_task
+    else:
+        buckets = await request_pmax_themes_llm(texts)
+    pmax_map = build_pmax_themes(buckets, texts, texts_lower, locations_list)
 
    
     # Final SEM Output
@@ -2,30 +2,57 @@
 #also make sure you download and extract the whole zip file from the repo to call the function of generating key words which is in main.py 
 
 
+import asyncio
+import sys
 import yaml
-import json
+import orjson
 import pandas as pd
 from schemas import SEMInputs
 from main import generate_sem_plan  
 
 
-def main():
-    # 1. This will load config file
-    with open("config.yaml", "r") as f:
-        config = yaml.safe_load(f)
+def load_config(path):
+    with open(path, "r") as f:
+        return yaml.safe_load(f)
+
+
+def save_output(path, data):
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+
+async def main():
+    # 1. This will load config file (a single advertiser, or a list of them for a batch run)
+    config = await asyncio.to_thread(load_config, "config.yaml")
+    configs = config if isinstance(config, list) else [config]
 
     # 2. This will take the input
-    inputs = SEMInputs(**config)
+    inputs = [SEMInputs(**c) for c in configs]
 
     # 3. we already made an existing file as main from there call this function and get the output
-    result = generate_sem_plan(inputs)
+    #    (advertisers in a batch are planned concurrently; one failure does not drop the others)
+    results = await asyncio.gather(*(generate_sem_plan(i) for i in inputs), return_exceptions=True)
+
+    data = []
+    for i, r in zip(inputs, results):
+        if isinstance(r, BaseException):
+            detail = getattr(r, "detail", None) or r
+            print(f"❌ {i.brand_website}: {detail}")
+        else:
+            data.append(r.model_dump())
+
+    # exit status: 0 all advertisers planned, 2 partial (successes still written), 1 nothing generated
+    if not data:
+        print("❌ No plans generated, output_keywords.json not written")
+        sys.exit(1)
 
-    # 4. saving to the json file 
-    with open("output_keywords.json", "w") as f:
-        json.dump(result.dict(), f, indent=2)
+    # 4. saving to the json file (successful advertisers only)
+    await asyncio.to_thread(save_output, "output_keywords.json", data if isinstance(config, list) else data[0])
 
-    print("✅ Keywords saved to output_keywords.json")
+    print(f"✅ Keywords saved to output_keywords.json ({len(data)}/{len(inputs)} advertisers)")
+    if len(data) < len(inputs):
+        sys.exit(2)
 
     
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
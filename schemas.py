@@ -1,16 +1,22 @@
 # schemas.py
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Dict, Optional
 
 
 class KeywordFull(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     keyword: str
     search_volume: Optional[int] = None
     competition: Optional[str] = None
+    low: Optional[float] = None
+    high: Optional[float] = None
     cpc_range: Optional[str] = None
 
 
 class ShoppingCPCSuggestion(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     keyword: str
     search_volume: Optional[int] = None
     competition: Optional[str] = None
@@ -19,6 +25,8 @@ class ShoppingCPCSuggestion(BaseModel):
 
 # --- PMax theme model used for each theme key ---
 class PMaxTheme(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     keywords: List[str]
     total_volume: int
 